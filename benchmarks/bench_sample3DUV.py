@@ -0,0 +1,64 @@
+"""Benchmark the velocity sampling in the ROMS gridforce
+
+Compares the fused trilinear kernel in sample3DUV (numpy and, if
+available, numba) with two separate calls to sample3D.
+
+Usage: python bench_sample3DUV.py [num_particles ...]
+
+"""
+
+import sys
+import time
+import numpy as np
+
+from ladim1.gridforce import ROMS
+from ladim1.gridforce.ROMS import sample3D, sample3DUV
+
+
+def two_calls(U, V, X, Y, K, A):
+    return sample3D(U, X + 0.5, Y, K, A), sample3D(V, X, Y + 0.5, K, A)
+
+
+def fused_numpy(U, V, X, Y, K, A):
+    return sample3DUV(U, V, X, Y, K, A)
+
+
+def fused_numba(U, V, X, Y, K, A):
+    return sample3DUV(U, V, X, Y, K, A, compiled=True)
+
+
+def timing(fun, *args, repeat=3):
+    """Best wall clock time of repeated calls"""
+    best = np.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fun(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main(sizes):
+
+    # Grid of the size of the NorKyst-800 model
+    kmax, jmax, imax = 42, 902, 2602
+    U = np.random.uniform(-1, 1, (kmax, jmax, imax - 1)).astype("f4")
+    V = np.random.uniform(-1, 1, (kmax, jmax - 1, imax)).astype("f4")
+
+    methods = [("sample3D x 2", two_calls), ("fused numpy", fused_numpy)]
+    if ROMS.numba is not None:
+        methods.append(("fused numba", fused_numba))
+
+    for pmax in sizes:
+        X = np.random.uniform(1, imax - 3, pmax)
+        Y = np.random.uniform(1, jmax - 3, pmax)
+        K = np.random.randint(1, kmax, pmax)
+        A = np.random.uniform(0, 1, pmax)
+        print(f"\nParticles: {pmax:d}")
+        for name, fun in methods:
+            fun(U, V, X[:10], Y[:10], K[:10], A[:10])  # Warm up, compile
+            print(f"  {name:14s} {timing(fun, U, V, X, Y, K, A):8.4f} s")
+
+
+if __name__ == "__main__":
+    sizes = [int(float(arg)) for arg in sys.argv[1:]]
+    main(sizes or [10**5, 10**6, 10**7])
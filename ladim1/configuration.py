@@ -241,7 +241,21 @@ def configure(config_stream) -> Config:
     config["particle_variables"] = prelease["particle_variables"]
 
     # --- Model state ---
-    # logging.info("Configuration: Model State Variables")
+    logging.info("Configuration: Model State")
+    # Fraction of dead particles before removing them from the state
+    try:
+        compaction_threshold = conf["state"]["compaction_threshold"]
+    except (KeyError, TypeError):
+        compaction_threshold = 0.0
+    config["compaction_threshold"] = compaction_threshold
+    logging.info(f'    {"compaction_threshold":15s}: {compaction_threshold}')
+    # Storage of instance variables: separate arrays or a single block
+    try:
+        state_storage = conf["state"]["storage"]
+    except (KeyError, TypeError):
+        state_storage = "separate"
+    config["state_storage"] = state_storage
+    logging.info(f'    {"storage":15s}: {state_storage}')
 
     # -----------------
     # Output control
@@ -307,6 +321,13 @@ def configure(config_stream) -> Config:
     except KeyError:
         config["advection"] = "RK4"
     logging.info(f'    {"advection":15s}: {config["advection"]}')
+    config["backend"] = conf["numerics"].get("backend", "numpy")
+    if config["backend"] not in ["numpy", "numba"]:
+        logging.error(f"Unknown numerics backend: {config['backend']}")
+        raise SystemExit(1)
+    logging.info(f'    {"backend":15s}: {config["backend"]}')
+    config["processes"] = conf["numerics"].get("processes", 1)
+    logging.info(f'    {"processes":15s}: {config["processes"]}')
     try:
         diffusion = conf["numerics"]["diffusion"]
     except KeyError:
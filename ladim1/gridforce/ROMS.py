@@ -13,10 +13,17 @@ Grid and Forcing for LADiM for the Regional Ocean Model System (ROMS)
 # import sys
 import glob
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 import numpy as np
 from netCDF4 import Dataset, num2date
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 from ladim1.sample import sample2D, bilin_inv
+from ladim1.utilities import netcdf_lock
 
 
 class Grid:
@@ -228,6 +235,19 @@ class Forcing:
     """
     Class for ROMS forcing
 
+    Possible forcing arguments:
+      prefetch = True | False [default]
+        Read the next forcing frame in a background thread
+        while the particles are tracked with the present frame.
+        Keeps one extra frame in memory.
+      active_window = True | False [default]
+        Read and store the fields only in a window around the particles.
+        The window is grown when particles approach its edge.
+      window_halo = minimum number of grid cells between the particles
+        and the edge of the active window, default = 5.
+        The halo is widened to the distance the maximum velocity
+        can move a particle during a forcing interval.
+
     """
 
     def __init__(self, config, grid):
@@ -259,7 +279,38 @@ class Forcing:
         self.stepdiff = np.diff(steps)
         self.file_idx = file_idx
         self.frame_idx = frame_idx
+        self.steps = steps
         self._nc = None
+        self._ncfile = None
+        # Positions and result of the last vertical index computation
+        self._z2s_positions = None
+        self._z2s_index = None
+
+        # Window [i0, i1, j0, j1] of the subgrid where fields are read
+        self.active_window = config["gridforce"].get("active_window", False)
+        if self.active_window:
+            logging.info("Reading forcing in active window around particles")
+            # No window before the first particles are sampled
+            self._window = None
+            self._min_halo = config["gridforce"].get("window_halo", 5)
+            self._interval = max(self.stepdiff) * config["dt"]  # [s]
+            self._dxmin = float(grid.dx.min())
+            self._vmax = 0.0  # Max speed in the frames read
+        else:
+            self._window = (grid.i0, grid.i1, grid.j0, grid.j1)
+
+        # Compiled velocity sampling
+        self._compiled = config.get("backend", "numpy") == "numba"
+        if self._compiled and numba is None:
+            logging.warning("numba is not available, numpy velocity sampling")
+            self._compiled = False
+
+        # Background reading of the next forcing frame
+        self.prefetch = config["gridforce"].get("prefetch", False)
+        if self.prefetch:
+            logging.info("Prefetching forcing in background thread")
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        self._prefetched = None  # (step, window, future) of frame being read
 
         # Read old input
         # requires at least one input before start
@@ -268,13 +319,22 @@ class Forcing:
         # prestep = last forcing step < 0
         #
 
+        # Keep track of the bracketing forcing frames and the time step
+        #   U = frame(prevstep) + (t - prevstep) * dU, interpolating
+        #   towards frame(nextstep), Unew = frame(newstep)
+        self._t = -1
+
         V = [step for step in steps if step < 0]
         if V:  # Forcing available before start time
             prestep = max(V)
             stepdiff = self.stepdiff[steps.index(prestep)]
             nextstep = prestep + stepdiff
-            self.U, self.V = self._read_velocity(prestep)
-            self.Unew, self.Vnew = self._read_velocity(nextstep)
+            self._prevstep = prestep
+            self._nextstep = self._newstep = nextstep
+            if self._window is None:  # Read when particles are present
+                return
+            self.U, self.V, fields = self._read_frame(prestep)
+            self.Unew, self.Vnew, newfields = self._next_frame(nextstep)
             self.dU = (self.Unew - self.U) / stepdiff
             self.dV = (self.Vnew - self.V) / stepdiff
             # Interpolate to time step = -1
@@ -282,16 +342,26 @@ class Forcing:
             self.V = self.V - (prestep + 1) * self.dV
             # Other forcing
             for name in self.ibm_forcing:
-                self[name] = self._read_field(name, prestep)
-                self[name + "new"] = self._read_field(name, nextstep)
+                self[name] = fields[name]
+                self[name + "new"] = newfields[name]
                 self["d" + name] = (self[name + "new"] - self[name]) / prestep
                 self[name] = self[name] - (prestep + 1) * self["d" + name]
 
         elif steps[0] == 0:
             # Simulation start at first forcing time
             # Runge-Kutta needs dU and dV in this case as well
-            self.U, self.V = self._read_velocity(0)
-            self.Unew, self.Vnew = self._read_velocity(steps[1])
+            self._prevstep = self._newstep = 0
+            self._nextstep = steps[1]
+            if self._window is None:  # Read when particles are present
+                return
+            self.U, self.V, fields = self._read_frame(0)
+            frame = self._read_frame(steps[1])
+            self.Unew, self.Vnew, newfields = frame
+            if self.prefetch:
+                # Asked for again at the first time step, keep it
+                future = Future()
+                future.set_result(frame)
+                self._prefetched = (steps[1], self._window, future)
             self.dU = (self.Unew - self.U) / steps[1]
             self.dV = (self.Vnew - self.V) / steps[1]
             # Synchronize with start time
@@ -302,8 +372,8 @@ class Forcing:
             self.V = self.V - self.dV
             # Other forcing:
             for name in self.ibm_forcing:
-                self[name] = self._read_field(name, 0)
-                self[name + "new"] = self._read_field(name, steps[1])
+                self[name] = fields[name]
+                self[name + "new"] = newfields[name]
                 self["d" + name] = (self[name + "new"] - self[name]) / steps[1]
                 self[name] = self[name] - self["d" + name]
 
@@ -311,9 +381,6 @@ class Forcing:
             # No forcing at start, should already be excluded
             raise SystemExit(3)
 
-        self.steps = steps
-        self._files = files
-
     # ===================================================
     @staticmethod
     def find_files(force_config):
@@ -409,7 +476,11 @@ class Forcing:
         interpolate_ibm_forcing_in_time = False
 
         logging.debug("Updating forcing, time step = {}".format(t))
+        self._t = t
         if t in self.steps:  # No time interpolation
+            self._newstep = t
+            if self._window is None:  # No particles yet
+                return
             self.U = self.Unew
             self.V = self.Vnew
             for name in self.ibm_forcing:
@@ -418,9 +489,13 @@ class Forcing:
             if t - 1 in self.steps:  # Need new fields
                 stepdiff = self.stepdiff[self.steps.index(t - 1)]
                 nextstep = t - 1 + stepdiff
-                self.Unew, self.Vnew = self._read_velocity(nextstep)
+                self._prevstep = t - 1
+                self._nextstep = self._newstep = nextstep
+                if self._window is None:  # No particles yet
+                    return
+                self.Unew, self.Vnew, fields = self._next_frame(nextstep)
                 for name in self.ibm_forcing:
-                    self[name + "new"] = self._read_field(name, nextstep)
+                    self[name + "new"] = fields[name]
                 if interpolate_velocity_in_time:
                     self.dU = (self.Unew - self.U) / stepdiff
                     self.dV = (self.Vnew - self.V) / stepdiff
@@ -429,6 +504,8 @@ class Forcing:
                         self["d" + name] = (self[name + "new"] - self[name]) / stepdiff
 
             # "Ordinary" time step (including self.steps+1)
+            if self._window is None:  # No particles yet
+                return
             if interpolate_velocity_in_time:
                 self.U += self.dU
                 self.V += self.dV
@@ -440,7 +517,8 @@ class Forcing:
 
     def open_forcing_file(self, n):
         """Open forcing file at time step = n"""
-        nc = self._nc
+        if self._nc:
+            self._nc.close()
         nc = Dataset(self.file_idx[n])
         nc.set_auto_maskandscale(False)
 
@@ -459,8 +537,9 @@ class Forcing:
                 self.scaled[key] = False
 
         self._nc = nc
+        self._ncfile = self.file_idx[n]
 
-    def _read_velocity(self, n):
+    def _read_velocity(self, n, window=None):
         """Read fields at time step = n"""
         # Need a switch for reading W
         # T = self._nc.variables['ocean_time'][n]  # Read new fields
@@ -469,18 +548,18 @@ class Forcing:
         # Always read velocity before other fields
         logging.info("Reading velocity for time step = {}".format(n))
 
-        # If finished a file or first read (self._nc == "")
-        if not self._nc:  # First read
-            self.open_forcing_file(n)
-        elif self.frame_idx[n] == 0:  # Just finished a forcing file
-            self._nc.close()
+        # First read or time step in another file
+        if self._ncfile != self.file_idx[n]:
             self.open_forcing_file(n)
 
         frame = self.frame_idx[n]
+        if window is None:
+            window = self._window
+        I, J, Iu, Jv = self._window_slices(window)
 
         # Read the velocity
-        U = self._nc.variables["u"][frame, :, self._grid.Ju, self._grid.Iu]
-        V = self._nc.variables["v"][frame, :, self._grid.Jv, self._grid.Iv]
+        U = self._nc.variables["u"][frame, :, J, Iu]
+        V = self._nc.variables["v"][frame, :, Jv, I]
 
         # Scale if needed
         # Assume offset = 0 for velocity
@@ -492,18 +571,148 @@ class Forcing:
 
         # If necessary put U,V = zero on land and land boundaries
         # Stay as float32
-        np.multiply(U, self._grid.Mu, out=U)
-        np.multiply(V, self._grid.Mv, out=V)
+        grid = self._grid
+        i0, i1, j0, j1 = window
+        Mu = grid.Mu[j0 - grid.j0 : j1 - grid.j0, i0 - grid.i0 : i1 - grid.i0 + 1]
+        Mv = grid.Mv[j0 - grid.j0 : j1 - grid.j0 + 1, i0 - grid.i0 : i1 - grid.i0]
+        np.multiply(U, Mu, out=U)
+        np.multiply(V, Mv, out=V)
         return U, V
 
-    def _read_field(self, name, n):
+    def _read_field(self, name, n, window=None):
         """Read a 3D field"""
         frame = self.frame_idx[n]
-        F = self._nc.variables[name][frame, :, self._grid.J, self._grid.I]
+        if window is None:
+            window = self._window
+        I, J, _, _ = self._window_slices(window)
+        F = self._nc.variables[name][frame, :, J, I]
         if self.scaled[name]:
             F = self.add_offset[name] + self.scale_factor[name] * F
         return F
 
+    def _read_frame(self, n, window=None):
+        """Read velocity and the ibm forcing fields at time step = n"""
+        with netcdf_lock:
+            U, V = self._read_velocity(n, window)
+            fields = {
+                name: self._read_field(name, n, window) for name in self.ibm_forcing
+            }
+        if self.active_window:
+            self._vmax = max(self._vmax, float(abs(U).max()), float(abs(V).max()))
+        return U, V, fields
+
+    @staticmethod
+    def _window_slices(window):
+        """Slices for rho-, u- and v-points of a window"""
+        i0, i1, j0, j1 = window
+        return slice(i0, i1), slice(j0, j1), slice(i0 - 1, i1), slice(j0 - 1, j1)
+
+    def _next_frame(self, n):
+        """Return the forcing frame at time step = n
+
+        Takes the frame from the prefetch thread if available,
+        and starts reading the following frame.
+        """
+        frame = None
+        if self._prefetched:
+            step, window, future = self._prefetched
+            self._prefetched = None
+            # Always wait, the file handle is not shared between threads
+            prefetched_frame = future.result()
+            if step == n and window == self._window:
+                frame = prefetched_frame
+        if frame is None:
+            frame = self._read_frame(n)
+
+        if self.prefetch:
+            index = self.steps.index(n) + 1
+            if index < len(self.steps):
+                step = self.steps[index]
+                window = self._window
+                future = self._executor.submit(self._read_frame, step, window)
+                self._prefetched = (step, window, future)
+
+        return frame
+
+    # --------------
+    # Active window
+    # --------------
+
+    def _check_window(self, X, Y):
+        """Grow the active window if particles approach its edge"""
+        if len(X) == 0:
+            return
+        grid = self._grid
+        # Halo from maximum velocity times forcing interval
+        halo = max(
+            self._min_halo, int(np.ceil(self._vmax * self._interval / self._dxmin))
+        )
+        xmin, xmax = int(np.floor(X.min())), int(np.ceil(X.max()))
+        ymin, ymax = int(np.floor(Y.min())), int(np.ceil(Y.max()))
+
+        window = (
+            max(grid.i0, xmin - halo),
+            min(grid.i1, xmax + halo + 1),
+            max(grid.j0, ymin - halo),
+            min(grid.j1, ymax + halo + 1),
+        )
+
+        if self._window is not None:
+            i0, i1, j0, j1 = self._window
+            margin = halo // 2
+            if (
+                (i0 == grid.i0 or i0 <= xmin - margin)
+                and (i1 == grid.i1 or xmax + margin < i1)
+                and (j0 == grid.j0 or j0 <= ymin - margin)
+                and (j1 == grid.j1 or ymax + margin < j1)
+            ):
+                return  # Window is OK
+            # Never shrink the window
+            window = (
+                min(window[0], i0),
+                max(window[1], i1),
+                min(window[2], j0),
+                max(window[3], j1),
+            )
+        logging.info(f"Active forcing window [i0, i1, j0, j1] = {list(window)}")
+        self._window = window
+        self._reload()
+
+    def _reload(self):
+        """Reread the bracketing forcing frames in a new window"""
+
+        # Drop any frame prefetched in the old window
+        if self._prefetched:
+            self._prefetched[2].result()
+            self._prefetched = None
+
+        t = self._t
+        prevstep, nextstep = self._prevstep, self._nextstep
+        stepdiff = nextstep - prevstep
+        U0, V0, fields0 = self._read_frame(prevstep)
+        U1, V1, fields1 = self._read_frame(nextstep)
+        self.dU = (U1 - U0) / stepdiff
+        self.dV = (V1 - V0) / stepdiff
+        self.U = U0 + (t - prevstep) * self.dU
+        self.V = V0 + (t - prevstep) * self.dV
+        if self._newstep == nextstep:
+            self.Unew, self.Vnew = U1, V1
+        else:  # Start at first forcing time, synchronized
+            self.Unew, self.Vnew = U0, V0
+        for name in self.ibm_forcing:
+            self[name] = fields1[name] if t >= nextstep else fields0[name]
+            self[name + "new"] = fields1[name]
+            self["d" + name] = (fields1[name] - fields0[name]) / stepdiff
+
+        # Start reading the following frame
+        if self.prefetch and self._newstep == nextstep:
+            index = self.steps.index(nextstep) + 1
+            if index < len(self.steps):
+                step = self.steps[index]
+                window = self._window
+                future = self._executor.submit(self._read_frame, step, window)
+                self._prefetched = (step, window, future)
+
     # Allow item notation
     def __setitem__(self, key, value):
         setattr(self, key, value)
@@ -515,10 +724,20 @@ class Forcing:
 
     def close(self):
 
-        self._nc.close()
+        if self.prefetch:
+            # Let a pending read finish before closing the file
+            self._executor.shutdown(wait=True)
+            self._prefetched = None
+        if self._nc:
+            with netcdf_lock:
+                self._nc.close()
 
     def velocity(self, X, Y, Z, tstep=0, method="bilinear"):
 
+        if self.active_window:
+            self._check_window(X, Y)
+            if self._window is None:  # No particles yet
+                return np.zeros_like(X), np.zeros_like(Y)
         i0 = self._grid.i0
         j0 = self._grid.j0
         K, A = z2s(self._grid.z_r, X - i0, Y - j0, Z)
@@ -528,16 +747,39 @@ class Forcing:
         else:
             U = self.U + tstep * self.dU
             V = self.V + tstep * self.dV
-        return sample3DUV(U, V, X - i0, Y - j0, K, A, method=method)
+        # Fields are stored in the window
+        wi0, _, wj0, _ = self._window
+        return sample3DUV(
+            U, V, X - wi0, Y - wj0, K, A, method=method, compiled=self._compiled
+        )
 
     # Simplify to grid cell
     def field(self, X, Y, Z, name):
-        # should not be necessary to repeat
+        if self.active_window:
+            self._check_window(X, Y)
+            if self._window is None:  # No particles yet
+                return np.zeros_like(X)
+        K, A = self._vertical_index(X, Y, Z)
+        F = self[name]
+        wi0, _, wj0, _ = self._window
+        return sample3D(F, X - wi0, Y - wj0, K, A, method="nearest")
+
+    def _vertical_index(self, X, Y, Z):
+        """Vertical index and weights for the fields
+
+        Reused as long as the fields are sampled at the same positions
+        """
+        positions = (X, Y, Z)
+        if self._z2s_positions is not None and all(
+            np.array_equal(new, old) for new, old in zip(positions, self._z2s_positions)
+        ):
+            return self._z2s_index
         i0 = self._grid.i0
         j0 = self._grid.j0
-        K, A = z2s(self._grid.z_r, X - i0, Y - j0, Z)
-        F = self[name]
-        return sample3D(F, X - i0, Y - j0, K, A, method="nearest")
+        self._z2s_index = z2s(self._grid.z_r, X - i0, Y - j0, Z)
+        # Take copies, the positions are changed in place
+        self._z2s_positions = tuple(np.array(A, copy=True) for A in positions)
+        return self._z2s_index
 
 
 # ---------------------------------------------
@@ -712,11 +954,25 @@ def z2s(z_rho, X, Y, Z):
     I = np.around(X).astype("int")
     J = np.around(Y).astype("int")
 
-    # Vectorized searchsorted
-    K = np.sum(z_rho[:, J, I] < -Z, axis=0)
+    # Flat index of the water columns
+    z_flat = z_rho.reshape(kmax, -1)
+    C = J * z_rho.shape[-1] + I
+
+    # Vectorized binary search, z_rho is increasing upwards
+    # K = number of levels with z_rho < -Z
+    K = np.zeros(C.shape, dtype=int)
+    K1 = np.full(C.shape, kmax)
+    for _ in range(int(np.ceil(np.log2(kmax + 1)))):
+        M = (K + K1) // 2
+        below = z_flat[np.minimum(M, kmax - 1), C] < -Z
+        searching = K < K1
+        K = np.where(searching & below, M + 1, K)
+        K1 = np.where(searching & ~below, M, K1)
     K = K.clip(1, kmax - 1)
 
-    A = (z_rho[K, J, I] + Z) / (z_rho[K, J, I] - z_rho[K - 1, J, I])
+    z0 = z_flat[K - 1, C]
+    z1 = z_flat[K, C]
+    A = (z1 + Z) / (z1 - z0)
     A = A.clip(0, 1)  # Extend constantly
 
     return K, A
@@ -774,8 +1030,86 @@ def sample3D(F, X, Y, K, A, method="bilinear"):
     return F[K, J, I]
 
 
-def sample3DUV(U, V, X, Y, K, A, method="bilinear"):
-    return (
-        sample3D(U, X + 0.5, Y, K, A, method=method),
-        sample3D(V, X, Y + 0.5, K, A, method=method),
+def sample3DUV(U, V, X, Y, K, A, method="bilinear", compiled=False):
+    """Sample the velocity components at the particle positions
+
+    U and V are on the staggered C-grid, X, Y in rho-points.
+    The trilinear case is done by a fused kernel sharing the vertical
+    weights between the components, compiled by numba if compiled is True.
+
+    """
+
+    if method != "bilinear":
+        return (
+            sample3D(U, X + 0.5, Y, K, A, method=method),
+            sample3D(V, X, Y + 0.5, K, A, method=method),
+        )
+
+    # The kernels do not catch points outside the fields
+    _check_inside(U, X + 0.5, Y)
+    _check_inside(V, X, Y + 0.5)
+
+    if compiled:
+        return _sample3DUV_numba(*(np.asarray(arg) for arg in (U, V, X, Y, K, A)))
+
+    B = 1 - A
+    return _trilinear(U, X + 0.5, Y, K, A, B), _trilinear(V, X, Y + 0.5, K, A, B)
+
+
+def _check_inside(F, X, Y):
+    """Raise IndexError if a bilinear sample point is outside F"""
+    if len(X) == 0:
+        return
+    _, jmax, imax = F.shape
+    if not (0 <= X.min() and X.max() < imax - 1 and 0 <= Y.min() and Y.max() < jmax - 1):
+        raise IndexError("Sample point outside the field")
+
+
+def _trilinear(F, X, Y, K, A, B):
+    """Trilinear interpolation by flat indexing, B = 1 - A"""
+
+    _, jmax, imax = F.shape
+    F = F.ravel()
+    I = X.astype("int")
+    J = Y.astype("int")
+    P = X - I
+    Q = Y - J
+    # Flat index of F[K, J, I] and F[K-1, J, I]
+    n1 = (K * jmax + J) * imax + I
+    n0 = n1 - jmax * imax
+    # Bilinear in the two levels
+    F1 = (1 - Q) * ((1 - P) * F[n1] + P * F[n1 + 1]) + Q * (
+        (1 - P) * F[n1 + imax] + P * F[n1 + imax + 1]
+    )
+    F0 = (1 - Q) * ((1 - P) * F[n0] + P * F[n0 + 1]) + Q * (
+        (1 - P) * F[n0 + imax] + P * F[n0 + imax + 1]
     )
+    return B * F1 + A * F0
+
+
+if numba is not None:
+
+    @numba.njit(cache=True, inline="always")
+    def _trilinear_point(F, x, y, k, a):
+        """Trilinear interpolation of F at a single point"""
+        i = int(x)
+        j = int(y)
+        p = x - i
+        q = y - j
+        f1 = (1 - q) * ((1 - p) * F[k, j, i] + p * F[k, j, i + 1]) + q * (
+            (1 - p) * F[k, j + 1, i] + p * F[k, j + 1, i + 1]
+        )
+        f0 = (1 - q) * ((1 - p) * F[k - 1, j, i] + p * F[k - 1, j, i + 1]) + q * (
+            (1 - p) * F[k - 1, j + 1, i] + p * F[k - 1, j + 1, i + 1]
+        )
+        return (1 - a) * f1 + a * f0
+
+    @numba.njit(parallel=True, cache=True)
+    def _sample3DUV_numba(U, V, X, Y, K, A):
+        pmax = len(X)
+        Up = np.empty(pmax)
+        Vp = np.empty(pmax)
+        for n in numba.prange(pmax):
+            Up[n] = _trilinear_point(U, X[n] + 0.5, Y[n], K[n], A[n])
+            Vp[n] = _trilinear_point(V, X[n], Y[n] + 0.5, K[n], A[n])
+        return Up, Vp
@@ -68,6 +68,7 @@ def main(config_stream, loglevel=logging.INFO):
         # --- Save to file ---
         # Save before or after update ???
         if step % config["output_period"] == 0:
+            state.compactify()  # Do not write dead particles
             out.write(state, grid)
 
         # --- Update the model state ---
@@ -78,5 +79,6 @@ def main(config_stream, loglevel=logging.INFO):
     # ========
 
     # TODO: should also close the releaser
+    state.close()
     forcing.close()
     # out.close()
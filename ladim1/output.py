@@ -16,6 +16,7 @@ from typing import Any, Dict
 import numpy as np
 from netCDF4 import Dataset
 
+from .utilities import netcdf_lock
 from .gridforce import Grid  # For mypy
 from .state import State  # For mypy
 from .release import ParticleReleaser  # For mypy
@@ -78,52 +79,57 @@ class OutPut:
             )
         )
 
-        # Create new file?
-        if t == 0:
-            # Close old file and open a new
-            if self.nc:
-                self.nc.close()
-            self.file_counter += 1
-            self.pstart0 = self.instance_count  # Start of data in the file
-            self.nc = self._define_netcdf()
-            logging.info(f"Opened output file: {self.nc.filepath()}")
-
-        pcount = len(state)  # Present number of particles
-        pstart = self.instance_count
-
-        logging.debug(f"Writing {pcount} particles")
-
-        tdelta = state.timestamp - self.config["reference_time"]
-        seconds = tdelta.astype("m8[s]").astype("int")
-        self.nc.variables["time"][t] = float(seconds)
-
-        self.nc.variables["particle_count"][t] = pcount
-
         # Compute lon, lat if needed
         if self.lonlat:
             lon, lat = grid.xy2ll(state.X, state.Y)
 
-        start = pstart - self.pstart0
-        end = pstart + pcount - self.pstart0
-        # print("start, end = ", start, end)
-        for name in self.instance_variables:
-            if name == "lon":
-                self.nc.variables["lon"][start:end] = lon
-            elif name == "lat":
-                self.nc.variables["lat"][start:end] = lat
-            else:
-                self.nc.variables[name][start:end] = state[name]
-
-        # Update counters
-        # self.outcount += 1
-        self.instance_count += pcount
-
-        # Flush the data to the file
-        self.nc.sync()
-
-        # Close final file
-        if self.outcount == self.num_output - 1:
-            self.nc.close()
+        # The forcing may be read in a background thread
+        with netcdf_lock:
+            # Create new file?
+            if t == 0:
+                # Close old file and open a new
+                if self.nc:
+                    self.nc.close()
+                self.file_counter += 1
+                self.pstart0 = self.instance_count  # Start of data in the file
+                self.nc = self._define_netcdf()
+                logging.info(f"Opened output file: {self.nc.filepath()}")
+
+            pcount = len(state)  # Present number of particles
+            pstart = self.instance_count
+
+            logging.debug(f"Writing {pcount} particles")
+
+            tdelta = state.timestamp - self.config["reference_time"]
+            seconds = tdelta.astype("m8[s]").astype("int")
+            self.nc.variables["time"][t] = float(seconds)
+
+            self.nc.variables["particle_count"][t] = pcount
+
+            start = pstart - self.pstart0
+            end = pstart + pcount - self.pstart0
+            # print("start, end = ", start, end)
+            values = state.gather(
+                [name for name in self.instance_variables if name not in ["lon", "lat"]]
+            )
+            for name in self.instance_variables:
+                if name == "lon":
+                    self.nc.variables["lon"][start:end] = lon
+                elif name == "lat":
+                    self.nc.variables["lat"][start:end] = lat
+                else:
+                    self.nc.variables[name][start:end] = values[name]
+
+            # Update counters
+            # self.outcount += 1
+            self.instance_count += pcount
+
+            # Flush the data to the file
+            self.nc.sync()
+
+            # Close final file
+            if self.outcount == self.num_output - 1:
+                self.nc.close()
 
     # -----------------------------------------------
     def _define_netcdf(self) -> Dataset:
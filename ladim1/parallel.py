@@ -0,0 +1,227 @@
+# ------------------------------------
+# parallel.py
+# Part of the LADiM Model
+#
+# Licenced under the MIT license
+# ------------------------------------
+
+"""Particle parallel tracking with worker processes
+
+The particles are independent given the forcing.  The worker processes
+are forked from the model, inheriting the grid and the forcing object,
+and move a contiguous partition of the particles each.
+
+The velocity arrays of the forcing live in shared memory.  A new array
+from the forcing (a new frame) is copied once and the forcing is
+pointed to the shared copy, so the time interpolation in the forcing
+updates the shared array in place.  The particle positions and the
+diffusive velocities are copied to shared memory each time step.
+
+The model state, the IBM and the output stay in the main process, and
+the random numbers are drawn there.  The results are identical to a
+serial run.
+
+"""
+
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import Dict, Tuple
+import numpy as np
+
+from .tracker import Tracker, Velocity
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Velocity arrays of the forcing to put in shared memory
+forcing_arrays = ["U", "V", "dU", "dV"]
+
+# Smallest length of the shared particle arrays
+min_capacity = 1024
+
+
+class ParallelTracker(Tracker):
+    """Particle tracking by a pool of worker processes"""
+
+    def __init__(self, config) -> None:
+        super().__init__(config)
+        self.processes = config["processes"]
+        if config["gridforce"].get("active_window", False):
+            logging.warning("Parallel tracking does not work with active_window")
+            self.processes = 1
+        if "fork" not in multiprocessing.get_all_start_methods():
+            logging.warning("Parallel tracking needs the fork start method")
+            self.processes = 1
+        logging.info(f"Particle tracking with {self.processes} processes")
+        self.pool = None
+        self._gridforce = None
+        self.capacity = 0  # Length of the shared particle arrays
+        # name -> (shared memory block, array)
+        self._shared: Dict[str, Tuple[shared_memory.SharedMemory, np.ndarray]] = {}
+
+    def move_particles(self, grid, forcing, state) -> None:
+        """Move the particles by the worker processes"""
+
+        if self.processes == 1:
+            super().move_particles(grid, forcing, state)
+            return
+
+        if self.pool is None:
+            # Fork before doing any work, the workers inherit the grid
+            # and the forcing objects
+            self.pool = multiprocessing.get_context("fork").Pool(
+                self.processes, initializer=_init_worker, initargs=(self, grid, forcing)
+            )
+
+        num_particles = len(state.X)
+        self.num_particles = num_particles
+        if num_particles == 0:
+            return
+        diffusion = self.diffuse() if self.diffusion else None
+
+        # Forcing arrays, copied only if changed
+        gridforce = getattr(forcing, "forcing", forcing)
+        self._gridforce = gridforce
+        for name in forcing_arrays:
+            if not hasattr(gridforce, name):
+                continue
+            value = getattr(gridforce, name)
+            if value is self._shared.get(name, (None, None))[1]:
+                continue  # Updated in place
+            A = self._share(name, value.shape, value.dtype)
+            A[...] = value
+            setattr(gridforce, name, A)
+
+        # Particle arrays
+        particles = dict(X=state.X, Y=state.Y, Z=state.Z, alive=state.alive)
+        if self.active_check:
+            particles["active"] = state.active
+        if diffusion is not None:
+            particles["Udiff"], particles["Vdiff"] = diffusion
+        if num_particles > self.capacity:
+            self.capacity = max(min_capacity, self.capacity)
+            while self.capacity < num_particles:
+                self.capacity *= 2
+        for name, value in particles.items():
+            A = self._share(name, (self.capacity,), np.asarray(value).dtype)
+            A[:num_particles] = value
+
+        spec = {
+            name: (shm.name, A.shape, A.dtype.str)
+            for name, (shm, A) in self._shared.items()
+        }
+        limits = np.linspace(0, num_particles, self.processes + 1).astype(int)
+        tasks = [(spec, start, stop) for start, stop in zip(limits[:-1], limits[1:])]
+        self.pool.starmap(_move_partition, tasks)
+
+        state.X[:] = self._shared["X"][1][:num_particles]
+        state.Y[:] = self._shared["Y"][1][:num_particles]
+        state.alive[:] = self._shared["alive"][1][:num_particles]
+
+    def _share(self, name, shape, dtype) -> np.ndarray:
+        """Shared array, reused if of the same shape and type"""
+        shm, A = self._shared.pop(name, (None, None))
+        if A is not None and A.shape == tuple(shape) and A.dtype == dtype:
+            self._shared[name] = shm, A
+            return A
+        if shm is not None:
+            del A  # No views into the block when closing
+            shm.close()
+            shm.unlink()
+        shm, A = _shared_array(shape, dtype)
+        self._shared[name] = shm, A
+        return A
+
+    def close(self) -> None:
+        """Stop the workers and release the shared memory"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        # Give the forcing private copies of the shared arrays
+        for name in forcing_arrays:
+            if name in self._shared:
+                setattr(self._gridforce, name, np.array(self._shared[name][1]))
+        while self._shared:
+            _, (shm, A) = self._shared.popitem()
+            del A
+            shm.close()
+            shm.unlink()
+
+
+def _shared_array(shape, dtype) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """New array in shared memory"""
+    dtype = np.dtype(dtype)
+    size = max(1, int(np.prod(shape)) * dtype.itemsize)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+# --------------------
+# Worker processes
+# --------------------
+
+# State of a worker process
+_worker: Dict = {}
+
+
+def _init_worker(tracker, grid, forcing) -> None:
+    """Keep the objects inherited from the model process"""
+    _worker["tracker"] = tracker
+    _worker["grid"] = grid
+    _worker["forcing"] = forcing
+    _worker["attached"] = {}
+    if numba is not None:
+        # One thread per process
+        numba.set_num_threads(1)
+
+
+class _Partition:
+    """Slice of the particle arrays, as seen by the tracker"""
+
+    def __init__(self, arrays, start, stop):
+        for name, A in arrays.items():
+            setattr(self, name, A[start:stop])
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+def _move_partition(spec, start: int, stop: int) -> None:
+    """Move a partition of the particles in a worker process"""
+
+    attached = _worker["attached"]
+    arrays = dict()
+    for name, (shm_name, shape, dtype) in spec.items():
+        if shm_name not in attached:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            attached[shm_name] = shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        arrays[name] = attached[shm_name][1]
+
+    forcing = _worker["forcing"]
+    gridforce = getattr(forcing, "forcing", forcing)
+    for name in forcing_arrays:
+        if name in arrays:
+            setattr(gridforce, name, arrays[name])
+
+    # Let go of replaced blocks
+    current = set(shm_name for shm_name, _, _ in spec.values())
+    for shm_name in list(attached):
+        if shm_name not in current:
+            shm, A = attached.pop(shm_name)
+            del A
+            shm.close()
+
+    particles = _Partition(
+        {name: A for name, A in arrays.items() if name not in forcing_arrays},
+        start,
+        stop,
+    )
+    diffusion: Velocity = None
+    if "Udiff" in arrays:
+        diffusion = particles.Udiff, particles.Vdiff
+    tracker = _worker["tracker"]
+    tracker.advance(_worker["grid"], forcing, particles, diffusion)
@@ -18,7 +18,7 @@ from typing import Iterator, List
 
 from netCDF4 import Dataset
 
-from .utilities import ingrid
+from .utilities import ingrid, netcdf_lock
 from .configuration import Config
 
 
@@ -195,7 +195,7 @@ class ParticleReleaser(Iterator):
 
         # Get particle data from  warm start
         if config["start"] == "warm":
-            with Dataset(config["warm_start_file"]) as f:
+            with netcdf_lock, Dataset(config["warm_start_file"]) as f:
                 # warm_particle_count = len(f.dimensions['particle'])
                 warm_particle_count = np.max(f.variables["pid"][:]) + 1
                 for name in config["particle_variables"]:
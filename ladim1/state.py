@@ -6,12 +6,14 @@ import sys
 import os
 import importlib
 import logging
-from typing import Any, Dict, Sized  # mypy
+from typing import Any, Dict, List, Sized  # mypy
 
 import numpy as np
 from netCDF4 import Dataset, num2date
 
+from .utilities import netcdf_lock
 from .tracker import Tracker
+from .parallel import ParallelTracker
 from .gridforce import Grid, Forcing
 
 # ------------------------
@@ -19,8 +21,26 @@ from .gridforce import Grid, Forcing
 Config = Dict[str, Any]
 
 
+def _is_head_view(value: np.ndarray, buffer: np.ndarray) -> bool:
+    """True if value is a view of the start of buffer"""
+    return isinstance(value, np.ndarray) and value.ctypes.data == buffer.ctypes.data
+
+
 class State(Sized):
-    """The model variables at a given time"""
+    """The model variables at a given time
+
+    The particle variables are views of the active part of
+    preallocated buffers. The buffers grow by doubling, so that
+    new particles can be appended in place.
+
+    Dead particles are kept until the fraction of dead particles
+    exceeds compaction_threshold, or compactify is called.
+
+    With storage = "block", the instance variables are rows of a
+    single 2D buffer, so that compaction is one gather.
+    """
+
+    min_capacity = 1024  # Initial size of the buffers
 
     def __init__(self, config: Config, grid: Grid) -> None:
 
@@ -43,11 +63,27 @@ class State(Sized):
         self.pid = np.array([], dtype=int)
         for name in self.instance_variables:
             setattr(self, name, np.array([], dtype=float))
+        self.alive = np.array([], dtype=bool)
+
+        # Preallocated buffers for the particle arrays
+        self._buffered = ["pid"] + self.instance_variables + ["alive"]
+        self._dtype = {name: float for name in self.instance_variables}
+        self._dtype.update(pid=int, alive=bool)
+        self._buffer: Dict[str, np.ndarray] = dict()
+        self.compaction_threshold = config.get("compaction_threshold", 0.0)
+        self.storage = config.get("state_storage", "separate")
+        if self.storage not in ["separate", "block"]:
+            logging.critical(f"Unknown state storage: {self.storage}")
+            raise SystemExit(1)
+        self._block = np.empty((len(self.instance_variables), 0))
 
         for name in self.particle_variables:
             setattr(self, name, np.array([], dtype=config["release_dtype"][name]))
 
-        self.track = Tracker(config)
+        if config.get("processes", 1) > 1:
+            self.track = ParallelTracker(config)
+        else:
+            self.track = Tracker(config)
         self.dt = config["dt"]
 
         if config["ibm_module"]:
@@ -75,31 +111,105 @@ class State(Sized):
     def __len__(self) -> int:
         return len(getattr(self, "X"))
 
+    def _capacity(self, capacity: int, size: int) -> int:
+        """New buffer capacity, doubling until size fits"""
+        capacity = max(capacity, self.min_capacity)
+        while capacity < size:
+            capacity *= 2
+        return capacity
+
+    def _reserve(self, size: int) -> None:
+        """Make the buffers hold the present particles and room for size"""
+        n = len(self)
+        if self.storage == "block" and self._block.shape[1] < size:
+            # The rows are filled by the variables below
+            capacity = self._capacity(self._block.shape[1], size)
+            self._block = np.empty((len(self.instance_variables), capacity))
+            for k, name in enumerate(self.instance_variables):
+                self._buffer[name] = self._block[k]
+        for name in self._buffered:
+            value = self[name]
+            if len(value) != n:  # Not set, all alive and zero
+                value = name == "alive"
+            buffer = self._buffer.get(name)
+            if buffer is None or len(buffer) < size:
+                capacity = self._capacity(0 if buffer is None else len(buffer), size)
+                buffer = np.empty(capacity, dtype=self._dtype[name])
+                buffer[:n] = value
+                self._buffer[name] = buffer
+            elif not _is_head_view(value, buffer):  # Variable has been replaced
+                buffer[:n] = value
+            self[name] = buffer[:n]
+
     def append(self, new: Dict[str, Any], forcing: Forcing) -> None:
         """Append new particles to the model state"""
         nnew = len(new["pid"])
-        self.pid = np.concatenate((self.pid, new["pid"]))
-        for name in self.instance_variables:
-            if name in new:
-                self[name] = np.concatenate((self[name], new[name]))
+        n = len(self)
+        self._reserve(n + nnew)
+        for name in self._buffered:
+            buffer = self._buffer[name]
+            if name == "alive":
+                buffer[n : n + nnew] = True
+            elif name in new:
+                buffer[n : n + nnew] = new[name]
             elif name in self.ibm_forcing:
                 # Take values as Z must be a numpy array
-                self[name] = np.concatenate(
-                    (
-                        self[name],
-                        forcing.field(new["X"], new["Y"], new["Z"].values, name),
-                    )
+                buffer[n : n + nnew] = forcing.field(
+                    new["X"], new["Y"], new["Z"].values, name
                 )
             else:  # Initialize to zero
-                self[name] = np.concatenate((self[name], np.zeros(nnew)))
+                buffer[n : n + nnew] = 0
+            self[name] = buffer[: n + nnew]
         self.nnew = nnew
 
+    def gather(self, names: List[str]) -> Dict[str, np.ndarray]:
+        """Values of the named particle variables
+
+        With block storage, the instance variables are taken
+        from the block in one gather
+        """
+        if self.storage == "block":
+            self._reserve(len(self))  # Replaced variables back into the block
+        values = {name: self[name] for name in names}
+        if self.storage == "block":
+            rows = [k for k, name in enumerate(self.instance_variables) if name in values]
+            if rows:
+                block = self._block[rows, : len(self)]
+                for k, row in enumerate(rows):
+                    values[self.instance_variables[row]] = block[k]
+        return values
+
+    def compactify(self) -> None:
+        """Remove the dead particles"""
+        alive = self.alive
+        if np.all(alive):
+            return
+        n = len(self)
+        m = np.count_nonzero(alive)
+        self._reserve(n)
+        if self.storage == "block":  # One gather for all instance variables
+            self._block[:, :m] = np.compress(alive, self._block[:, :n], axis=1)
+        for name in self._buffered:
+            buffer = self._buffer[name]
+            if name == "alive":
+                buffer[:m] = True
+            elif self.storage == "separate" or name == "pid":
+                buffer[:m] = buffer[:n][alive]
+            self[name] = buffer[:m]
+
+    def close(self) -> None:
+        """Release the resources of the particle tracking"""
+        self.track.close()
+
     def update(self, grid: Grid, forcing: Forcing) -> None:
         """Update the model state to the next timestep"""
 
         # From physics all particles are alive
         # self.alive = np.ones(len(self), dtype="bool")
-        self.alive = grid.ingrid(self.X, self.Y)
+        if len(self.alive) != len(self):  # Particles set without append
+            self.alive = np.ones(len(self), dtype=bool)
+        # Particles already dead are kept until compaction
+        self.alive &= grid.ingrid(self.X, self.Y)
 
         self.timestep += 1
         self.timestamp += np.timedelta64(self.dt, "s")
@@ -130,42 +240,49 @@ class State(Sized):
         self.Z[I] = 0.99 * H[I]
 
         # Compactify by removing dead particles
-        # Could have a switch to avoid this if no deaths
-        self.pid = self.pid[self.alive]
-        for key in self.instance_variables:
-            self[key] = self[key][self.alive]
+        # Delayed until enough particles are dead
+        num_dead = len(self) - np.count_nonzero(self.alive)
+        if num_dead > self.compaction_threshold * len(self):
+            self.compactify()
 
     def warm_start(self, config: Config, grid: Grid) -> None:
         """Perform a warm (re)start"""
 
         warm_start_file = config["warm_start_file"]
-        try:
-            f = Dataset(warm_start_file)
-        except FileNotFoundError:
-            logging.critical(f"Can not open warm start file: {warm_start_file}")
-            raise SystemExit(1)
-
-        logging.info("Reading warm start file")
-        # Using last record in file
-        tvar = f.variables["time"]
-        warm_start_time = np.datetime64(num2date(tvar[-1], tvar.units))
-        # Not needed anymore, explicitly set in configuration
-        # if warm_start_time != config['start_time']:
-        #    print("warm start time = ", warm_start_time)
-        #    print("start time      = ", config['start_time'])
-        #    logging.error("Warm start time and start time differ")
-        #    raise SystemExit(1)
-
-        pstart = f.variables["particle_count"][:-1].sum()
-        pcount = f.variables["particle_count"][-1]
-        self.pid = f.variables["pid"][pstart : pstart + pcount]
-        # Give error if variable not in restart file
-        for var in config["warm_start_variables"]:
-            logging.debug(f"Reading {var} from warm start file")
-            self[var] = f.variables[var][pstart : pstart + pcount]
+        # The forcing may be read in a background thread
+        with netcdf_lock:
+            try:
+                f = Dataset(warm_start_file)
+            except FileNotFoundError:
+                logging.critical(f"Can not open warm start file: {warm_start_file}")
+                raise SystemExit(1)
+
+            logging.info("Reading warm start file")
+            # Using last record in file
+            tvar = f.variables["time"]
+            warm_start_time = np.datetime64(num2date(tvar[-1], tvar.units))
+            # Not needed anymore, explicitly set in configuration
+            # if warm_start_time != config['start_time']:
+            #    print("warm start time = ", warm_start_time)
+            #    print("start time      = ", config['start_time'])
+            #    logging.error("Warm start time and start time differ")
+            #    raise SystemExit(1)
+
+            pstart = f.variables["particle_count"][:-1].sum()
+            pcount = f.variables["particle_count"][-1]
+            self.pid = f.variables["pid"][pstart : pstart + pcount]
+            # Give error if variable not in restart file
+            for var in config["warm_start_variables"]:
+                logging.debug(f"Reading {var} from warm start file")
+                self[var] = f.variables[var][pstart : pstart + pcount]
+            f.close()
+
+        # Into the buffers, variables not in the file are set to zero
+        for name in self.instance_variables:
+            if len(self[name]) != len(self):
+                logging.warning(f"{name} not in warm start, set to zero")
+        self._reserve(len(self))
 
         # Remove particles near edge of grid
-        I = grid.ingrid(self["X"], self["Y"])
-        self.pid = self.pid[I]
-        for var in config["warm_start_variables"]:
-            self[var] = self[var][I]
+        self.alive = grid.ingrid(self["X"], self["Y"])
+        self.compactify()
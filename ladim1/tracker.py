@@ -9,10 +9,11 @@
 # ------------------------------------
 
 import logging
-from typing import Any, Tuple
+from typing import Any, Optional, Tuple
 import numpy as np
 
 from .gridforce import Grid, Forcing
+from . import tracker_numba
 
 # from .state import State   # Circular import
 from .configuration import Config
@@ -27,6 +28,7 @@ class Tracker:
     def __init__(self, config: Config) -> None:
         logging.info("Initiating the particle tracking")
         self.dt = config["dt"]
+        self.advection = config["advection"]
         if config["advection"]:
             self.advect = getattr(self, config["advection"])
         else:
@@ -37,9 +39,45 @@ class Tracker:
             self.D = config["diffusion_coefficient"]  # [m2.s-1]
         self.active_check = 'active' in config['ibm_variables']
 
+        # Compiled tracking kernel, falls back to numpy if not possible
+        self.backend = config.get("backend", "numpy")
+        if self.backend == "numba":
+            if tracker_numba.numba is None:
+                logging.warning("numba is not available, using numpy backend")
+                self.backend = "numpy"
+            elif config["gridforce"]["module"] != "ladim1.gridforce.ROMS":
+                logging.warning("numba backend needs ROMS gridforce, using numpy")
+                self.backend = "numpy"
+            elif config["gridforce"].get("active_window", False):
+                # The window must be checked at every Runge-Kutta stage
+                logging.warning("numba backend does not handle active_window, using numpy")
+                self.backend = "numpy"
+            elif self.advect and self.advection not in tracker_numba.schemes:
+                logging.warning(
+                    f"numba backend does not handle {self.advection}, using numpy"
+                )
+                self.backend = "numpy"
+
     def move_particles(self, grid: Grid, forcing: Forcing, state: State) -> None:
         """Move the particles"""
 
+        self.num_particles = len(state.X)
+        diffusion = self.diffuse() if self.diffusion else None
+        self.advance(grid, forcing, state, diffusion)
+
+    def advance(
+        self,
+        grid: Grid,
+        forcing: Forcing,
+        state: State,
+        diffusion: Optional[Velocity] = None,
+    ) -> None:
+        """Move the particles, given the diffusive velocity"""
+
+        if self.backend == "numba":
+            tracker_numba.move_particles(self, grid, forcing, state, diffusion)
+            return
+
         X, Y = state.X, state.Y
         dx, dy = grid.sample_metric(X, Y)
         self.dx, self.dy = dx, dy
@@ -62,8 +100,8 @@ class Tracker:
             V += Vadv
 
         # --- Diffusion ---
-        if self.diffusion:
-            Udiff, Vdiff = self.diffuse()
+        if diffusion is not None:
+            Udiff, Vdiff = diffusion
             U += Udiff
             V += Vdiff
 
@@ -206,6 +244,10 @@ class Tracker:
 
     RK4 = RK4b
 
+    def close(self) -> None:
+        """Nothing to release for the serial tracker"""
+        pass
+
     def diffuse(self) -> Velocity:
         """Random walk diffusion"""
 
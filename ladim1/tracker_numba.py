@@ -0,0 +1,259 @@
+# ------------------------------------
+# tracker_numba.py
+# Part of the LADiM Model
+#
+# Compiled particle tracking kernel
+#
+# Licenced under the MIT license
+# ------------------------------------
+
+"""Compiled particle tracking for the ROMS gridforce
+
+The whole time step for a particle, metric, advection, diffusion and
+boundary treatment, is done in one loop over the particles,
+parallelised by numba.  The arithmetic follows the numpy code in
+tracker.py and gridforce/ROMS.py operation by operation, so the
+results are identical.  The random numbers are drawn by numpy outside
+the kernel.
+
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Advection schemes handled by the kernel, number of velocity evaluations
+schemes = {"EF": 1, "RK2": 2, "RK2b": 2, "RK4": 4, "RK4b": 4}
+
+
+def move_particles(tracker, grid, forcing, state, diffusion=None):
+    """Move the particles, compiled version of Tracker.advance"""
+
+    grid = getattr(grid, "grid", grid)
+    forcing = getattr(forcing, "forcing", forcing)
+    X, Y, Z = state.X, state.Y, state.Z
+    tracker.num_particles = len(X)
+    if len(X) == 0:
+        return
+
+    # Whole subgrid, no active window
+    wi0, _, wj0, _ = forcing._window
+
+    if tracker.advect:
+        scheme = schemes[tracker.advection]
+        U, V = np.asarray(forcing.U), np.asarray(forcing.V)
+        dU, dV = np.asarray(forcing.dU), np.asarray(forcing.dV)
+    else:
+        scheme = 0
+        U = V = dU = dV = np.zeros((1, 1, 1), dtype="f4")
+    # Time fractions in the precision of the velocity
+    tsteps = np.array([0.0, 0.5, 1.0], dtype=U.dtype)
+
+    if diffusion is not None:
+        Udiff, Vdiff = diffusion
+    else:
+        Udiff = Vdiff = np.zeros(0)
+
+    if tracker.active_check:
+        active = np.asarray(state.active)
+    else:
+        active = np.zeros(0)
+
+    clip_box = np.array(
+        [grid.xmin + 0.01, grid.xmax - 0.01, grid.ymin + 0.01, grid.ymax - 0.01]
+    )
+    grid_box = np.array(
+        [grid.xmin + 0.5, grid.xmax - 0.5, grid.ymin + 0.5, grid.ymax - 0.5]
+    )
+
+    _move(
+        X,
+        Y,
+        np.asarray(Z),
+        state.alive,
+        active,
+        Udiff,
+        Vdiff,
+        U,
+        V,
+        dU,
+        dV,
+        tsteps,
+        np.asarray(grid.z_r),
+        np.asarray(grid.dx),
+        np.asarray(grid.M),
+        grid.i0,
+        grid.j0,
+        wi0,
+        wj0,
+        float(tracker.dt),
+        scheme,
+        clip_box,
+        grid_box,
+    )
+
+
+if numba is not None:
+
+    @numba.njit(cache=True, inline="always")
+    def _value(F, dF, tstep, k, j, i):
+        """Field value, time interpolated in the precision of F"""
+        if tstep < 0.001:
+            return F[k, j, i]
+        return F[k, j, i] + tstep * dF[k, j, i]
+
+    @numba.njit(cache=True, inline="always")
+    def _trilinear(F, dF, tstep, x, y, k, a):
+        """Trilinear interpolation, as sample3DUV"""
+        i = int(x)
+        j = int(y)
+        p = x - i
+        q = y - j
+        f1 = (1 - q) * (
+            (1 - p) * _value(F, dF, tstep, k, j, i)
+            + p * _value(F, dF, tstep, k, j, i + 1)
+        ) + q * (
+            (1 - p) * _value(F, dF, tstep, k, j + 1, i)
+            + p * _value(F, dF, tstep, k, j + 1, i + 1)
+        )
+        f0 = (1 - q) * (
+            (1 - p) * _value(F, dF, tstep, k - 1, j, i)
+            + p * _value(F, dF, tstep, k - 1, j, i + 1)
+        ) + q * (
+            (1 - p) * _value(F, dF, tstep, k - 1, j + 1, i)
+            + p * _value(F, dF, tstep, k - 1, j + 1, i + 1)
+        )
+        return (1 - a) * f1 + a * f0
+
+    @numba.njit(cache=True, inline="always")
+    def _velocity(x, y, z, tstep, U, V, dU, dV, z_r, i0, j0, wi0, wj0):
+        """Velocity at a particle, as Forcing.velocity"""
+
+        # Vertical index and weight, as z2s
+        kmax = z_r.shape[0]
+        ic = int(np.rint(x - i0))
+        jc = int(np.rint(y - j0))
+        lo = 0
+        hi = kmax
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if z_r[mid, jc, ic] < -z:
+                lo = mid + 1
+            else:
+                hi = mid
+        k = min(max(lo, 1), kmax - 1)
+        z0 = z_r[k - 1, jc, ic]
+        z1 = z_r[k, jc, ic]
+        a = (z1 + z) / (z1 - z0)
+        a = min(max(a, 0.0), 1.0)
+
+        # Velocities are stored in the forcing window
+        xw = x - wi0
+        yw = y - wj0
+        u = _trilinear(U, dU, tstep, xw + 0.5, yw, k, a)
+        v = _trilinear(V, dV, tstep, xw, yw + 0.5, k, a)
+        return u, v
+
+    @numba.njit(parallel=True, cache=True)
+    def _move(
+        X,
+        Y,
+        Z,
+        alive,
+        active,
+        Udiff,
+        Vdiff,
+        U,
+        V,
+        dU,
+        dV,
+        tsteps,
+        z_r,
+        dxm,
+        M,
+        i0,
+        j0,
+        wi0,
+        wj0,
+        dt,
+        scheme,
+        clip_box,
+        grid_box,
+    ):
+        xmin, xmax, ymin, ymax = clip_box[0], clip_box[1], clip_box[2], clip_box[3]
+        diffusion = len(Udiff) > 0
+        active_check = len(active) > 0
+
+        for n in numba.prange(len(X)):
+            x = X[n]
+            y = Y[n]
+            z = Z[n]
+            # Metric, nearest neighbour
+            dx = dxm[int(np.rint(y)) - j0, int(np.rint(x)) - i0]
+            dy = dx
+
+            # --- Advection ---
+            u = 0.0
+            v = 0.0
+            if scheme == 1:
+                u, v = _velocity(x, y, z, tsteps[0], U, V, dU, dV, z_r, i0, j0, wi0, wj0)
+            elif scheme == 2:
+                u1, v1 = _velocity(
+                    x, y, z, tsteps[0], U, V, dU, dV, z_r, i0, j0, wi0, wj0
+                )
+                x1 = min(max(x + 0.5 * u1 * dt / dx, xmin), xmax)
+                y1 = min(max(y + 0.5 * v1 * dt / dy, ymin), ymax)
+                u, v = _velocity(
+                    x1, y1, z, tsteps[1], U, V, dU, dV, z_r, i0, j0, wi0, wj0
+                )
+            elif scheme == 4:
+                u1, v1 = _velocity(
+                    x, y, z, tsteps[0], U, V, dU, dV, z_r, i0, j0, wi0, wj0
+                )
+                x1 = min(max(x + 0.5 * u1 * dt / dx, xmin), xmax)
+                y1 = min(max(y + 0.5 * v1 * dt / dy, ymin), ymax)
+                u2, v2 = _velocity(
+                    x1, y1, z, tsteps[1], U, V, dU, dV, z_r, i0, j0, wi0, wj0
+                )
+                x2 = min(max(x + 0.5 * u2 * dt / dx, xmin), xmax)
+                y2 = min(max(y + 0.5 * v2 * dt / dy, ymin), ymax)
+                u3, v3 = _velocity(
+                    x2, y2, z, tsteps[1], U, V, dU, dV, z_r, i0, j0, wi0, wj0
+                )
+                x3 = min(max(x + u3 * dt / dx, xmin), xmax)
+                y3 = min(max(y + v3 * dt / dy, ymin), ymax)
+                u4, v4 = _velocity(
+                    x3, y3, z, tsteps[2], U, V, dU, dV, z_r, i0, j0, wi0, wj0
+                )
+                u = (u1 + 2 * u2 + 2 * u3 + u4) / 6.0
+                v = (v1 + 2 * v2 + 2 * v3 + v4) / 6.0
+
+            # --- Diffusion ---
+            if diffusion:
+                u = u + Udiff[n]
+                v = v + Vdiff[n]
+
+            # --- Move the particle ---
+            x1 = x + u * dt / dx
+            y1 = y + v * dt / dy
+
+            # Do not move out of grid, kill the particle
+            if not (
+                grid_box[0] < x1 < grid_box[1] and grid_box[2] < y1 < grid_box[3]
+            ):
+                x1 = x
+                y1 = y
+                alive[n] = False
+
+            # Do not move inactive particles
+            if active_check and active[n] < 1:
+                x1 = x
+                y1 = y
+
+            # Land, do not move the particle
+            if M[int(np.rint(y1)) - j0, int(np.rint(x1)) - i0] > 0:
+                X[n] = x1
+                Y[n] = y1
@@ -2,9 +2,14 @@
 General utilities for LADiM
 """
 
+import threading
 from typing import Any, Dict, List
 import numpy as np
 
+# The netCDF library is not thread safe, all netCDF4 calls made
+# while a background thread may be reading or writing go through this lock
+netcdf_lock = threading.RLock()
+
 
 def timestep2stamp(config: Dict[str, Any], n: int) -> np.datetime64:
     """Convert from time step number to timestamp"""
@@ -0,0 +1,101 @@
+"""Shared fixtures for the LADiM tests"""
+
+import numpy as np
+from netCDF4 import Dataset
+import pytest
+
+
+def make_roms_files(path, imax=20, jmax=15, N=5, num_files=2, frames_per_file=3):
+    """Make a small ROMS-type grid and forcing file set
+
+    The velocity and the scalar fields vary linearly with the hour,
+    u = 0.1 + 0.01*hour, v = -0.05 + 0.02*hour, temp = 10 + hour,
+    salt = 34 - 0.1*hour, so time interpolation is exact.
+    The upper right corner of the grid is land.
+
+    """
+
+    H = 50.0 + 2.0 * np.add.outer(np.arange(jmax), np.arange(imax))
+    M = np.ones((jmax, imax))
+    M[-4:, -4:] = 0
+    S_r = -1.0 + (0.5 + np.arange(N)) / N
+    S_w = np.linspace(-1.0, 0.0, N + 1)
+
+    files = []
+    for f in range(num_files):
+        fname = str(path / f"ocean_{f:04d}.nc")
+        files.append(fname)
+        nc = Dataset(fname, mode="w")
+        nc.createDimension("ocean_time", frames_per_file)
+        nc.createDimension("s_rho", N)
+        nc.createDimension("s_w", N + 1)
+        nc.createDimension("eta_rho", jmax)
+        nc.createDimension("xi_rho", imax)
+        nc.createDimension("eta_u", jmax)
+        nc.createDimension("xi_u", imax - 1)
+        nc.createDimension("eta_v", jmax - 1)
+        nc.createDimension("xi_v", imax)
+
+        v = nc.createVariable("ocean_time", "f8", ("ocean_time",))
+        v.units = "seconds since 2015-01-01 00:00:00"
+        hours = f * frames_per_file + np.arange(frames_per_file)
+        v[:] = 3600 * hours
+
+        nc.createVariable("hc", "f8", ())[:] = 10.0
+        nc.createVariable("Vtransform", "i4", ())[:] = 2
+        nc.createVariable("Cs_r", "f8", ("s_rho",))[:] = S_r
+        nc.createVariable("Cs_w", "f8", ("s_w",))[:] = S_w
+
+        for name, value in [
+            ("h", H),
+            ("mask_rho", M),
+            ("pm", 0.001 + np.zeros((jmax, imax))),
+            ("pn", 0.001 + np.zeros((jmax, imax))),
+            ("lon_rho", 5.0 + 0.01 * np.add.outer(np.zeros(jmax), np.arange(imax))),
+            ("lat_rho", 60.0 + 0.01 * np.add.outer(np.arange(jmax), np.zeros(imax))),
+            ("angle", np.zeros((jmax, imax))),
+        ]:
+            nc.createVariable(name, "f8", ("eta_rho", "xi_rho"))[:] = value
+
+        u = nc.createVariable("u", "i2", ("ocean_time", "s_rho", "eta_u", "xi_u"))
+        u.scale_factor = 0.001
+        u.add_offset = 0.0
+        v = nc.createVariable("v", "i2", ("ocean_time", "s_rho", "eta_v", "xi_v"))
+        v.scale_factor = 0.001
+        v.add_offset = 0.0
+        temp = nc.createVariable(
+            "temp", "f4", ("ocean_time", "s_rho", "eta_rho", "xi_rho")
+        )
+        salt = nc.createVariable(
+            "salt", "i2", ("ocean_time", "s_rho", "eta_rho", "xi_rho")
+        )
+        salt.scale_factor = 0.01
+        salt.add_offset = 30.0
+        for i, hour in enumerate(hours):
+            u[i] = 0.1 + 0.01 * hour
+            v[i] = -0.05 + 0.02 * hour
+            temp[i] = 10.0 + hour
+            salt[i] = 34.0 - 0.1 * hour
+        nc.close()
+
+    return files
+
+
+@pytest.fixture
+def roms_config(tmp_path):
+    """Configuration for a small ROMS grid and forcing file set
+
+    Six hourly forcing records, simulation with half-hour time step
+    from 01:00 to 04:00.
+    """
+    make_roms_files(tmp_path)
+    return dict(
+        start_time=np.datetime64("2015-01-01 01:00:00"),
+        stop_time=np.datetime64("2015-01-01 04:00:00"),
+        dt=1800,
+        ibm_forcing=["temp", "salt"],
+        gridforce=dict(
+            module="ladim1.gridforce.ROMS",
+            input_file=str(tmp_path / "ocean_*.nc"),
+        ),
+    )
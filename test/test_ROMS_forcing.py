@@ -3,7 +3,8 @@ from datetime import datetime
 import numpy as np
 from netCDF4 import Dataset
 import pytest
-from ladim1.gridforce.ROMS import Forcing
+from ladim1.gridforce import ROMS
+from ladim1.gridforce.ROMS import Grid, Forcing
 
 
 @pytest.fixture
@@ -103,3 +104,123 @@ def test_forcing_steps(nc_files):
     assert steps[k] == v
     assert file_idx[v] == f"test_file{d:02d}.nc"
     assert frame_idx[v] == f  # second time frame in file
+
+
+def test_prefetch(roms_config):
+    """Prefetching the forcing gives the same fields"""
+    X = np.array([5.0, 8.3, 12.7])
+    Y = np.array([5.0, 6.1, 3.4])
+    Z = np.array([3.0, 10.0, 30.0])
+
+    grid = Grid(roms_config)
+    forcing = Forcing(roms_config, grid)
+    roms_config["gridforce"]["prefetch"] = True
+    pforcing = Forcing(roms_config, grid)
+
+    for step in range(7):
+        forcing.update(step)
+        pforcing.update(step)
+        U, V = forcing.velocity(X, Y, Z, tstep=0.5)
+        pU, pV = pforcing.velocity(X, Y, Z, tstep=0.5)
+        assert np.all(U == pU)
+        assert np.all(V == pV)
+        for name in ["temp", "salt"]:
+            F = forcing.field(X, Y, Z, name)
+            assert np.all(F == pforcing.field(X, Y, Z, name))
+    # Linear in time, hour = 1 + step/2
+    assert pU[0] == pytest.approx(0.1 + 0.01 * 4.25)
+
+    forcing.close()
+    pforcing.close()
+
+
+def test_prefetch_from_first_frame(roms_config, monkeypatch):
+    """Starting at the first forcing time, no frame is read twice"""
+    roms_config["start_time"] = np.datetime64("2015-01-01 00:00:00")
+    roms_config["gridforce"]["prefetch"] = True
+    read = []
+    read_frame = ROMS.Forcing._read_frame
+
+    def logged_read_frame(self, n, window=None):
+        read.append(n)
+        return read_frame(self, n, window)
+
+    monkeypatch.setattr(ROMS.Forcing, "_read_frame", logged_read_frame)
+    grid = Grid(roms_config)
+    forcing = Forcing(roms_config, grid)
+    for step in range(7):
+        forcing.update(step)
+    forcing.close()
+    assert sorted(read) == [0, 2, 4, 6, 8]
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_active_window(roms_config, prefetch):
+    """Reading the forcing in a window around the particles gives the same values"""
+
+    grid = Grid(roms_config)
+    forcing = Forcing(roms_config, grid)
+    roms_config["gridforce"].update(
+        active_window=True, window_halo=2, prefetch=prefetch
+    )
+    wforcing = Forcing(roms_config, grid)
+
+    X = np.array([5.2, 6.3])
+    Y = np.array([5.0, 6.1])
+    Z = np.array([3.0, 10.0])
+    for step in range(7):
+        forcing.update(step)
+        wforcing.update(step)
+        if step == 0:  # No particles yet
+            U, V = wforcing.velocity(X[:0], Y[:0], Z[:0])
+            assert len(U) == 0
+            continue
+        U, V = forcing.velocity(X, Y, Z, tstep=0.5)
+        wU, wV = wforcing.velocity(X, Y, Z, tstep=0.5)
+        assert np.all(U == wU)
+        assert np.all(V == wV)
+        for name in ["temp", "salt"]:
+            F = forcing.field(X, Y, Z, name)
+            assert np.all(F == wforcing.field(X, Y, Z, name))
+        # Move eastwards, the window must follow
+        X = X + 1.5
+
+    i0, i1, j0, j1 = wforcing._window
+    assert i1 - i0 < grid.imax
+    assert j1 - j0 < grid.jmax
+    assert wforcing.U.shape == (grid.N, j1 - j0, i1 - i0 + 1)
+    assert i1 > X.max() - 1.5
+
+    forcing.close()
+    wforcing.close()
+
+
+def test_field_reuses_vertical_index(roms_config, monkeypatch):
+    """Fields at the same positions need only one vertical search"""
+    import ladim1.gridforce.ROMS as ROMS
+
+    calls = []
+
+    def counting_z2s(*args):
+        calls.append(1)
+        return z2s(*args)
+
+    z2s = ROMS.z2s
+    monkeypatch.setattr(ROMS, "z2s", counting_z2s)
+
+    grid = Grid(roms_config)
+    forcing = Forcing(roms_config, grid)
+    forcing.update(0)
+    X = np.array([5.0, 8.3])
+    Y = np.array([5.0, 6.1])
+    Z = np.array([3.0, 10.0])
+    temp = forcing.field(X, Y, Z, "temp")
+    salt = forcing.field(X, Y, Z, "salt")
+    assert len(calls) == 1
+    # Changed in place
+    Z += 5.0
+    forcing.field(X, Y, Z, "temp")
+    assert len(calls) == 2
+    assert np.all(temp == 11.0)
+    assert np.all(salt == pytest.approx(33.9))
+    forcing.close()
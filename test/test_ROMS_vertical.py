@@ -1,5 +1,7 @@
 import numpy as np
-from ladim1.gridforce.ROMS import sdepth, z2s, sample3D
+import pytest
+from ladim1.gridforce import ROMS
+from ladim1.gridforce.ROMS import sdepth, z2s, sample3D, sample3DUV
 
 
 # Make a module level fixture for these tests
@@ -53,6 +55,27 @@ def test_z2s():
     atest(-10)  # Above surface
 
 
+def test_z2s_search():
+    """The binary search agrees with counting the levels"""
+    kmax = 42
+    H = np.random.uniform(5.0, 500.0, (20, 30))
+    C = np.random.uniform(-1, 0, kmax)
+    C.sort()
+    z_rho = sdepth(H, 10.0, C, stagger="rho", Vtransform=2)
+    X = np.random.uniform(0, 29, 1000)
+    Y = np.random.uniform(0, 19, 1000)
+    Z = np.random.uniform(-10, 510, 1000)
+    # Include depths exactly at the levels
+    I, J = np.round(X).astype(int), np.round(Y).astype(int)
+    Z[:kmax] = -z_rho[np.arange(kmax), J[:kmax], I[:kmax]]
+
+    K, A = z2s(z_rho, X, Y, Z)
+    K0 = np.sum(z_rho[:, J, I] < -Z, axis=0).clip(1, kmax - 1)
+    assert np.all(K == K0)
+    A0 = (z_rho[K0, J, I] + Z) / (z_rho[K0, J, I] - z_rho[K0 - 1, J, I])
+    assert np.all(A == A0.clip(0, 1))
+
+
 def test_sample3D():
     # Set-up
     kmax = 30
@@ -77,3 +100,30 @@ def test_sample3D():
     assert V[1] == -Z[1]
     assert V[2] == -Z[2]
     assert V[3] == z_r[0, 3]  # -Z < z_rho[0]
+
+
+@pytest.mark.parametrize("compiled", [False, True])
+def test_sample3DUV(compiled):
+    """The fused kernel agrees with sampling each component by sample3D"""
+    if compiled and ROMS.numba is None:
+        pytest.skip("numba not available")
+    kmax, jmax, imax = 6, 12, 10
+    U = np.random.uniform(-1, 1, (kmax, jmax, imax - 1))
+    V = np.random.uniform(-1, 1, (kmax, jmax - 1, imax))
+    pmax = 1000
+    X = np.random.uniform(0.5, imax - 3, pmax)
+    Y = np.random.uniform(0.5, jmax - 3, pmax)
+    K = np.random.randint(1, kmax, pmax)
+    A = np.random.uniform(0, 1, pmax)
+    U0 = sample3D(U, X + 0.5, Y, K, A)
+    V0 = sample3D(V, X, Y + 0.5, K, A)
+    U1, V1 = sample3DUV(U, V, X, Y, K, A, compiled=compiled)
+    assert np.allclose(U1, U0, rtol=0, atol=1e-12)
+    assert np.allclose(V1, V0, rtol=0, atol=1e-12)
+
+    # Outside the field, as sample3D
+    X[0] = imax - 1.2
+    with pytest.raises(IndexError):
+        sample3D(U, X + 0.5, Y, K, A)
+    with pytest.raises(IndexError):
+        sample3DUV(U, V, X, Y, K, A, compiled=compiled)
@@ -1,6 +1,7 @@
 # from ladim1.configuration import Configure
 # from typing import List
 import numpy as np
+import pytest
 from ladim1.state import State
 
 
@@ -43,5 +44,142 @@ def test_append() -> None:
     assert np.all(state.pid == np.array([0, 1]))
     assert np.all(state["X"] == np.array([10.2, 2.0]))
 
+
+
+def test_append_in_place() -> None:
+    """Appending particles reuses the buffers until full"""
+    state = State(config, grid)
+    for i in range(3):
+        new = dict(pid=[i], X=[float(i)], Y=[1.0], Z=[5.0], super=[1.0], age=[0.0])
+        state.append(new, forcing=None)
+    X = state.X
+    new = dict(pid=[3], X=[3.0], Y=[1.0], Z=[5.0], super=[1.0], age=[0.0])
+    state.append(new, forcing=None)
+    assert len(state) == 4
+    assert np.shares_memory(X, state.X)
+    assert np.all(state.X == [0.0, 1.0, 2.0, 3.0])
+    assert np.all(state.alive)
+
+    # Grow beyond the capacity
+    nnew = State.min_capacity
+    new = dict(
+        pid=np.arange(4, 4 + nnew),
+        X=np.arange(4.0, 4 + nnew),
+        Y=np.ones(nnew),
+        Z=np.ones(nnew),
+    )
+    state.append(new, forcing=None)
+    assert len(state) == 4 + nnew
+    assert np.all(state.pid == np.arange(4 + nnew))
+    assert np.all(state.X == state.pid)
+    assert np.all(state.super[4:] == 0.0)
+
+
+@pytest.mark.parametrize("storage", ["separate", "block"])
+def test_compactify(storage) -> None:
+    """Compaction removes the dead particles from all variables"""
+    state = State(dict(config, state_storage=storage), grid)
+    new = dict(
+        pid=np.arange(10), X=np.arange(10.0), Y=np.ones(10), Z=np.ones(10)
+    )
+    state.append(new, forcing=None)
+    # Replaced array, as done by the IBMs
+    state.age = np.arange(10.0)
+
+    state.alive[[2, 5]] = False
+    state.compactify()
+    assert len(state) == 8
+    assert np.all(state.pid == [0, 1, 3, 4, 6, 7, 8, 9])
+    assert np.all(state.age == state.pid)
+    assert np.all(state.alive)
+
+    new = dict(pid=[10], X=[10.0], Y=[1.0], Z=[1.0])
+    state.append(new, forcing=None)
+    assert np.all(state.age == [0, 1, 3, 4, 6, 7, 8, 9, 0])
+    assert np.all(state.X[:-1] == state.pid[:-1])
+
+
+class MovingGrid:
+    """Grid for the compaction tests"""
+
+    xmin, xmax, ymin, ymax = 0.0, 99.0, 0.0, 99.0
+
+    def sample_metric(self, X, Y):
+        return 100 * np.ones_like(X), 100 * np.ones_like(Y)
+
+    def sample_depth(self, X, Y):
+        return 50.0 * np.ones_like(X)
+
+    def ingrid(self, X, Y):
+        return (0.0 <= X) & (X <= 99.0) & (0.0 <= Y) & (Y <= 99.0)
+
+    def atsea(self, X, Y):
+        return np.ones(len(X), dtype="bool")
+
+
+class EastwardForcing:
+    """Velocity moving the particles six grid cells per time step"""
+
+    def velocity(self, X, Y, Z):
+        return np.ones_like(X), np.zeros_like(Y)
+
+
+@pytest.mark.parametrize("threshold, compacted", [(0.5, False), (0.2, True)])
+def test_compaction_threshold(threshold, compacted) -> None:
+    """Dead particles are kept until their fraction passes the threshold"""
+    grid = MovingGrid()
+    state = State(
+        dict(
+            config,
+            ibm_module="",
+            ibm_variables=[],
+            advection="EF",
+            compaction_threshold=threshold,
+        ),
+        grid,
+    )
+    state.append(
+        dict(
+            pid=np.arange(4),
+            X=np.array([30.0, 95.0, 11.1, 50.0]),
+            Y=np.array([30.0, 40.0, 22.2, 50.0]),
+            Z=5.0 * np.ones(4),
+        ),
+        forcing=None,
+    )
+
+    # Particle 1 leaves the grid, dead fraction = 0.25
+    state.update(grid, EastwardForcing())
+    if compacted:
+        assert np.all(state.pid == [0, 2, 3])
+        assert np.all(state.alive)
+    else:
+        assert np.all(state.pid == [0, 1, 2, 3])
+        assert np.all(state.alive == [True, False, True, True])
+        state.compactify()
+        assert np.all(state.pid == [0, 2, 3])
+    assert np.all(state.X == [36.0, 17.1, 56.0])
+
+
+def test_block_storage() -> None:
+    """The instance variables share a single memory block"""
+    state = State(dict(config, state_storage="block"), grid)
+    nnew = State.min_capacity + 1
+    new = dict(pid=np.arange(nnew), X=np.arange(nnew), Y=np.ones(nnew), Z=np.ones(nnew))
+    state.append(new, forcing=None)
+    assert state.X.base is state.age.base
+    assert state.X.flags.c_contiguous
+    assert np.all(state.X == state.pid)
+    assert np.all(state.Y == 1.0)
+    assert np.all(state.super == 0.0)
+
+    # Output gathers from the block, also replaced variables
+    state.age = np.arange(nnew) + 0.5
+    values = state.gather(["pid", "X", "age"])
+    assert np.all(values["pid"] == state.pid)
+    assert np.all(values["X"] == state.pid)
+    assert np.all(values["age"] == state.pid + 0.5)
+
+
 # Make a test where new particles get initial temperature
-# from a forcing file
\ No newline at end of file
+# from a forcing file
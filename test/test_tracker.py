@@ -1,7 +1,11 @@
 import numpy as np
+import pytest
+from ladim1 import gridforce, tracker_numba
 from ladim1.state import State
+from ladim1.tracker import Tracker
 
 # from ladim1.tracker import Tracker
+from ladim1.parallel import ParallelTracker
 
 
 class Grid:
@@ -76,5 +80,118 @@ def test_out_of_area():
     assert state.pid[1] == 2
 
 
+class Particles:
+    """Minimal particle state for the tracker"""
+
+    def __init__(self, **variables):
+        self.__dict__.update(variables)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+@pytest.mark.parametrize(
+    "advection, active_window",
+    [("EF", False), ("RK2", False), ("RK4", False), ("RK4", True)],
+)
+def test_numba_backend(roms_config, advection, active_window):
+    """The compiled kernel moves the particles exactly as numpy
+
+    With active window, the numpy backend is used
+    """
+    if tracker_numba.numba is None:
+        pytest.skip("numba not available")
+
+    roms_config["gridforce"]["active_window"] = active_window
+    grid = gridforce.Grid(roms_config)
+    forcing = gridforce.Forcing(roms_config, grid)
+    forcing.update(1)  # Between forcing frames
+    # Make the velocity field non-uniform, the window is read on demand
+    rng = np.random.default_rng(0)
+    for name in [] if active_window else ["U", "V", "dU", "dV"]:
+        shape = forcing.forcing[name].shape
+        forcing.forcing[name] = rng.uniform(-0.5, 0.5, shape).astype("f4")
+
+    config = dict(
+        roms_config,
+        advection=advection,
+        diffusion=True,
+        diffusion_coefficient=10.0,
+        ibm_variables=[],
+    )
+    pmax = 1000
+    X = rng.uniform(1.6, 17.4, pmax)
+    Y = rng.uniform(1.6, 12.4, pmax)
+    Z = rng.uniform(0.0, 80.0, pmax)
+
+    result = dict()
+    for backend in ["numpy", "numba"]:
+        tracker = Tracker(dict(config, backend=backend))
+        assert tracker.backend == ("numpy" if active_window else backend)
+        state = Particles(
+            X=X.copy(), Y=Y.copy(), Z=Z.copy(), alive=np.ones(pmax, dtype=bool)
+        )
+        np.random.seed(1)
+        tracker.move_particles(grid, forcing, state)
+        result[backend] = state
+
+    numpy, numba = result["numpy"], result["numba"]
+    assert np.all(numba.X == numpy.X)
+    assert np.all(numba.Y == numpy.Y)
+    assert np.all(numba.alive == numpy.alive)
+    # Some particles should have moved, left the grid or hit land
+    assert np.any(numpy.X != X)
+    assert not np.all(numpy.alive)
+    forcing.close()
+
+
+@pytest.mark.parametrize("backend", ["numpy", "numba"])
+def test_parallel(roms_config, backend):
+    """Parallel tracking gives the same result as serial"""
+    if backend == "numba" and tracker_numba.numba is None:
+        pytest.skip("numba not available")
+
+    config = dict(
+        roms_config,
+        advection="RK4",
+        diffusion=True,
+        diffusion_coefficient=10.0,
+        ibm_variables=[],
+        backend=backend,
+    )
+    pmax = 3000
+    rng = np.random.default_rng(0)
+    X0 = rng.uniform(1.6, 17.4, pmax)
+    Y0 = rng.uniform(1.6, 12.4, pmax)
+    Z0 = rng.uniform(0.0, 80.0, pmax)
+
+    result = dict()
+    for processes in [1, 3]:
+        grid = gridforce.Grid(config)
+        forcing = gridforce.Forcing(config, grid)
+        # Make the initial velocity field non-uniform
+        rng = np.random.default_rng(1)
+        for name in ["U", "V", "dU", "dV"]:
+            shape = forcing.forcing[name].shape
+            forcing.forcing[name] = rng.uniform(-0.2, 0.2, shape).astype("f4")
+        tracker = ParallelTracker(dict(config, processes=processes))
+        state = Particles(
+            X=X0.copy(), Y=Y0.copy(), Z=Z0.copy(), alive=np.ones(pmax, dtype=bool)
+        )
+        np.random.seed(1)
+        for step in range(1, 6):
+            forcing.update(step)
+            tracker.move_particles(grid, forcing, state)
+        tracker.close()
+        forcing.close()
+        result[processes] = state
+
+    serial, parallel = result[1], result[3]
+    assert np.all(parallel.X == serial.X)
+    assert np.all(parallel.Y == serial.Y)
+    assert np.all(parallel.alive == serial.alive)
+    assert not np.all(serial.alive)
+
+
 if __name__ == "__main__":
     test_out_of_area()